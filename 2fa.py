@@ -4,45 +4,154 @@
 TOTP验证码生成器，github Two-factor authentication
 """
 
+import io
 import os
 import sys
 import time
-import json
-import getpass
-import argparse
+import hmac
+import mmap
+import base64
+import binascii
+import functools
 from pathlib import Path
 
 try:
+    import orjson
     import pyotp
-    import qrcode
 except ImportError:
     print("请先安装必要的依赖包:")
-    print("pip install pyotp qrcode[pil]")
+    print("pip install orjson pyotp qrcode pypng")
     sys.exit(1)
 
+_CLEAR = "\x1b[H\x1b[2J"
+_vt_enabled = False
+
+
+def _enable_vt():
+    """Windows控制台需要先执行一次空命令以启用ANSI转义序列，只做一次"""
+    global _vt_enabled
+    if not _vt_enabled:
+        if os.name == 'nt':
+            os.system('')
+        _vt_enabled = True
+
+
+def _normalize_secret(secret):
+    """规范化base32密钥: 去掉空格和填充并转为大写"""
+    return secret.replace(' ', '').upper().rstrip('=')
+
+
+def _decode_secret(secret):
+    """将base32密钥解码为HMAC密钥字节 (自动补齐填充)"""
+    secret = _normalize_secret(secret)
+    secret += '=' * (-len(secret) % 8)
+    return base64.b32decode(secret, casefold=True)
+
+
+def _truncate(mac):
+    """RFC 4226 动态截断，得到6位验证码"""
+    off = mac[19] & 0xF
+    val = (((mac[off] & 0x7F) << 24) | (mac[off + 1] << 16)
+           | (mac[off + 2] << 8) | mac[off + 3])
+    return f"{val % 1000000:06d}"
+
+
+def _make_hmac(key):
+    """生成绑定了账户密钥的HMAC-SHA1函数，调用时只需传入计数器块"""
+    return functools.partial(hmac.digest, key, digest='sha1')
+
+
+def _account_hmac(info):
+    """由账户信息生成HMAC函数，密钥缺失或无效时返回None"""
+    try:
+        key = _decode_secret(info['secret'])
+    except (binascii.Error, ValueError, KeyError, TypeError, AttributeError):
+        return None
+    return _make_hmac(key) if key else None
+
+
+@functools.lru_cache(maxsize=1)
+def _counter_bytes(step):
+    """计数器的8字节大端表示，同一周期内所有账户共用"""
+    return step.to_bytes(8, 'big')
+
 
 class TOTPManager:
     def __init__(self):
-        self.config_dir = os.getcwd()
-        self.config_file = os.path.join(self.config_dir, 'totp_accounts.json')
+        self.config_dir = Path.cwd()
+        self.config_file = self.config_dir / 'totp_accounts.json'
         self.accounts = self._load_accounts()
+        self._build_index()
+        # 验证码在同一个30秒周期内不变，按周期缓存
+        self._cached_step = None
+        self._cached_codes = []
+        # 已编码的二维码及其PNG数据，按 (账户, 掩码) 缓存
+        self._qr_cache = {}
     
     def _load_accounts(self):
         """加载已保存的账户"""
-        if os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError):
-                return {}
-        return {}
+        if not self.config_file.exists():
+            return {}
+        try:
+            with open(self.config_file, 'rb') as f:
+                try:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (ValueError, OSError):
+                    # 空文件或平台不支持mmap时退回普通读取
+                    data = orjson.loads(f.read())
+                else:
+                    try:
+                        with memoryview(mm) as view:
+                            data = orjson.loads(view)
+                    finally:
+                        mm.close()
+        except (orjson.JSONDecodeError, IOError):
+            return {}
+        # 顶层必须是 {账户名: 账户信息} 的字典
+        return data if isinstance(data, dict) else {}
+    
+    def _build_index(self):
+        """按账户顺序建立并行数组，配置文件格式保持不变"""
+        self._names = list(self.accounts)
+        # 密钥无效的账户对应 None，仍可列出和删除，只在生成验证码时报错
+        self._hmacs = [_account_hmac(info) for info in self.accounts.values()]
+        self._issuers = [info.get('issuer', name) if isinstance(info, dict)
+                         else name for name, info in self.accounts.items()]
+        # 预先格式化显示前后缀，刷新时只需拼接验证码
+        self._display_prefix = [f"{name:20} " for name in self._names]
+        self._display_suffix = [f" ({issuer})" for issuer in self._issuers]
+        self._index = {name: i for i, name in enumerate(self._names)}
+    
+    def _drop_qr_cache(self, name):
+        """删除该账户所有掩码下缓存的二维码"""
+        for key in [key for key in self._qr_cache if key[0] == name]:
+            del self._qr_cache[key]
     
     def _save_accounts(self):
         """保存账户到配置文件"""
+        data = orjson.dumps(self.accounts,
+                            option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        tmp_file = self.config_file.with_name(self.config_file.name + '.tmp')
+        # Windows 没有 O_CLOEXEC，macOS 没有 fdatasync
+        flags = (os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+                 | getattr(os, 'O_CLOEXEC', 0) | getattr(os, 'O_BINARY', 0))
+        sync = getattr(os, 'fdatasync', os.fsync)
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.accounts, f, indent=2, ensure_ascii=False)
-        except IOError as e:
+            # 先写临时文件并落盘，再原子替换，避免监控模式读到半写的配置
+            fd = os.open(tmp_file, flags, 0o600)
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                sync(fd)
+            finally:
+                os.close(fd)
+            os.replace(tmp_file, self.config_file)
+        except OSError as e:
+            try:
+                os.unlink(tmp_file)
+            except OSError:
+                pass
             print(f"保存配置文件失败: {e}")
     
     def add_account(self, name, secret, issuer=None):
@@ -52,10 +161,35 @@ class TOTPManager:
             if overwrite.lower() != 'y':
                 return False
         
+        # 保存规范化后的密钥，二维码中的 otpauth URI 也使用它
+        secret = _normalize_secret(secret)
+        try:
+            key = _decode_secret(secret)
+        except (binascii.Error, ValueError):
+            key = None
+        if not key:
+            print("密钥格式无效，应为base32编码!")
+            return False
+        
+        issuer = issuer or name
         self.accounts[name] = {
             'secret': secret,
-            'issuer': issuer or name
+            'issuer': issuer
         }
+        if name in self._index:
+            i = self._index[name]
+            self._hmacs[i] = _make_hmac(key)
+            self._issuers[i] = issuer
+            self._display_suffix[i] = f" ({issuer})"
+        else:
+            self._index[name] = len(self._names)
+            self._names.append(name)
+            self._hmacs.append(_make_hmac(key))
+            self._issuers.append(issuer)
+            self._display_prefix.append(f"{name:20} ")
+            self._display_suffix.append(f" ({issuer})")
+        self._drop_qr_cache(name)
+        self._cached_step = None
         self._save_accounts()
         print(f"账户 '{name}' 添加成功!")
         return True
@@ -64,6 +198,16 @@ class TOTPManager:
         """删除账户"""
         if name in self.accounts:
             del self.accounts[name]
+            i = self._index.pop(name)
+            del self._names[i]
+            del self._hmacs[i]
+            del self._issuers[i]
+            del self._display_prefix[i]
+            del self._display_suffix[i]
+            for j in range(i, len(self._names)):
+                self._index[self._names[j]] = j
+            self._drop_qr_cache(name)
+            self._cached_step = None
             self._save_accounts()
             print(f"账户 '{name}' 删除成功!")
             return True
@@ -78,8 +222,8 @@ class TOTPManager:
             return
         
         print("保存的账户:")
-        for name, info in self.accounts.items():
-            print(f"  - {name} ({info.get('issuer', name)})")
+        for name, issuer in zip(self._names, self._issuers):
+            print(f"  - {name} ({issuer})")
     
     def generate_code(self, name):
         """生成指定账户的TOTP验证码"""
@@ -87,63 +231,142 @@ class TOTPManager:
             print(f"账户 '{name}' 不存在!")
             return None
         
-        secret = self.accounts[name]['secret']
-        totp = pyotp.TOTP(secret)
-        code = totp.now()
-        remaining = 30 - (int(time.time()) % 30)
+        hmac_fn = self._hmacs[self._index[name]]
+        if hmac_fn is None:
+            print(f"账户 '{name}' 的密钥无效!")
+            return None
+        
+        current_time = int(time.time())
+        code = _truncate(hmac_fn(_counter_bytes(current_time // 30)))
+        remaining = 30 - (current_time % 30)
         
         return code, remaining
     
-    def generate_all_codes(self):
-        """生成所有账户的TOTP验证码"""
+    def generate_all_codes(self, show_remaining=True):
+        """生成所有账户的TOTP验证码
+        
+        监控模式下由单独的倒计时行显示剩余时间，show_remaining 为 False
+        时标题不再带剩余时间。
+        """
         if not self.accounts:
             print("没有保存的账户")
             return
         
         current_time = int(time.time())
         remaining = 30 - (current_time % 30)
+        step = current_time // 30
         
-        print(f"TOTP验证码 (剩余时间: {remaining}秒):")
-        print("-" * 40)
+        if step != self._cached_step:
+            # 所有账户共用同一个计数器块，只有密钥不同
+            counter_bytes = _counter_bytes(step)
+            self._cached_codes = [
+                _truncate(mac(counter_bytes)) if mac else "密钥无效"
+                for mac in self._hmacs
+            ]
+            self._cached_step = step
         
-        for name, info in self.accounts.items():
-            secret = info['secret']
-            totp = pyotp.TOTP(secret)
-            code = totp.now()
-            issuer = info.get('issuer', name)
-            print(f"{name:20} {code:>6} ({issuer})")
+        # 整帧拼接后一次写出，减少系统调用并避免闪烁
+        prefix = self._display_prefix
+        suffix = self._display_suffix
+        header = (f"TOTP验证码 (剩余时间: {remaining}秒):" if show_remaining
+                  else "TOTP验证码:")
+        lines = [header, "-" * 40]
+        codes = self._cached_codes
+        lines.extend(''.join((prefix[i], codes[i], suffix[i]))
+                     for i in range(len(codes)))
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+    
+    def watch(self):
+        """实时监控模式，每个30秒周期只重绘一次验证码"""
+        _enable_vt()
+        while True:
+            if not self._names:
+                # 没有账户时无需倒计时，直接等待下一个周期
+                sys.stdout.write(_CLEAR)
+                print("没有保存的账户", flush=True)
+                time.sleep(30)
+                continue
+            
+            step = int(time.time()) // 30
+            sys.stdout.write(_CLEAR)
+            sys.stdout.flush()
+            self.generate_all_codes(show_remaining=False)
+            
+            # 周期内只在同一行刷新倒计时，直到下一个周期开始
+            while int(time.time()) // 30 == step:
+                remaining = 30 - (int(time.time()) % 30)
+                sys.stdout.write(f"\r\x1b[K剩余时间: {remaining}秒")
+                sys.stdout.flush()
+                time.sleep(1 - time.time() % 1)
     
-    def generate_qr_code(self, name):
-        """生成二维码"""
+    def generate_qr_code(self, name, mask=None):
+        """生成二维码
+        
+        mask 为 0-7 时使用固定掩码，跳过8种掩码的评估；注册用二维码
+        只需能被扫描，固定掩码即可满足。
+        """
         if name not in self.accounts:
             print(f"账户 '{name}' 不存在!")
             return
         
-        account_info = self.accounts[name]
-        secret = account_info['secret']
-        issuer = account_info.get('issuer', name)
+        if self._hmacs[self._index[name]] is None:
+            print(f"账户 '{name}' 的密钥无效!")
+            return
         
-        totp = pyotp.TOTP(secret)
-        provisioning_uri = totp.provisioning_uri(
-            name=name,
-            issuer_name=issuer
-        )
+        cached = self._qr_cache.get((name, mask))
+        if cached is None:
+            # qrcode 只在生成二维码时用到，延迟导入以加快启动
+            try:
+                import qrcode
+                # 优先用pypng逐行编码PNG；qrcode[pil] 的旧安装没有pypng，退回PIL
+                try:
+                    import png  # noqa: F401
+                    import qrcode.image.pure
+                    image_factory = qrcode.image.pure.PyPNGImage
+                except ImportError:
+                    import qrcode.image.pil
+                    image_factory = qrcode.image.pil.PilImage
+            except ImportError:
+                print("请先安装二维码依赖包:")
+                print("pip install qrcode pypng")
+                return
+            
+            account_info = self.accounts[name]
+            # 旧配置中可能保存了带空格或小写的密钥，URI中使用规范形式
+            secret = _normalize_secret(account_info['secret'])
+            issuer = account_info.get('issuer', name)
+            
+            totp = pyotp.TOTP(secret)
+            provisioning_uri = totp.provisioning_uri(
+                name=name,
+                issuer_name=issuer
+            )
+            
+            qr = qrcode.QRCode(version=1, box_size=10, border=5,
+                               mask_pattern=mask)
+            qr.add_data(provisioning_uri)
+            qr.make(fit=True)
+            
+            img = qr.make_image(image_factory=image_factory)
+            img_bytes = io.BytesIO()
+            img.save(img_bytes)
+            cached = self._qr_cache[name, mask] = (qr, img_bytes.getvalue())
         
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(provisioning_uri)
-        qr.make(fit=True)
+        qr, png_data = cached
         
         # 在控制台显示二维码
         qr.print_ascii()
         
         # 保存二维码图片
-        img = qr.make_image(fill_color="black", back_color="white")
         qr_file = self.config_dir / f"{name}_qr.png"
-        img.save(qr_file)
+        qr_file.write_bytes(png_data)
         print(f"二维码已保存到: {qr_file}")
 
 
 def main():
+    import argparse
+    
     parser = argparse.ArgumentParser(description="跨平台TOTP验证码生成器")
     parser.add_argument("--add", "-a", help="添加新账户")
     parser.add_argument("--secret", "-s", help="账户密钥")
@@ -153,6 +376,8 @@ def main():
     parser.add_argument("--generate", "-g", help="生成指定账户的验证码")
     parser.add_argument("--all", action="store_true", help="生成所有账户的验证码")
     parser.add_argument("--qr", "-q", help="生成指定账户的二维码")
+    parser.add_argument("--mask", type=int, choices=range(8), default=None,
+                        help="二维码使用固定掩码 (0-7)，跳过掩码评估以加快生成")
     parser.add_argument("--watch", "-w", action="store_true", help="实时监控模式")
     
     args = parser.parse_args()
@@ -161,6 +386,7 @@ def main():
     
     if args.add:
         if not args.secret:
+            import getpass
             secret = getpass.getpass("请输入密钥 (输入时不显示): ")
         else:
             secret = args.secret
@@ -185,15 +411,12 @@ def main():
         manager.generate_all_codes()
     
     elif args.qr:
-        manager.generate_qr_code(args.qr)
+        manager.generate_qr_code(args.qr, args.mask)
     
     elif args.watch:
         print("实时监控模式 (按 Ctrl+C 退出)")
         try:
-            while True:
-                os.system('cls' if os.name == 'nt' else 'clear')
-                manager.generate_all_codes()
-                time.sleep(1)
+            manager.watch()
         except KeyboardInterrupt:
             print("\n退出监控模式")
     
@@ -219,6 +442,7 @@ def main():
             if choice == "1":
                 name = input("账户名称: ").strip()
                 if name:
+                    import getpass
                     secret = getpass.getpass("密钥 (输入时不显示): ").strip()
                     issuer = input("发行者 (可选): ").strip() or None
                     manager.add_account(name, secret, issuer)
@@ -254,10 +478,7 @@ def main():
             elif choice == "7":
                 print("实时监控模式 (按 Ctrl+C 返回菜单)")
                 try:
-                    while True:
-                        os.system('cls' if os.name == 'nt' else 'clear')
-                        manager.generate_all_codes()
-                        time.sleep(1)
+                    manager.watch()
                 except KeyboardInterrupt:
                     print("\n返回主菜单")
             